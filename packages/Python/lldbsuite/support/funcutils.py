@@ -9,8 +9,13 @@ import inspect
 # LLDB modules
 
 def requires_self(func):
-    func_argc = len(inspect.getargspec(func).args)
-    if func_argc == 0 or (getattr(func,'im_self', None) is not None) or (hasattr(func, '__self__')):
+    if (getattr(func,'im_self', None) is not None) or (hasattr(func, '__self__')):
         return False
-    else:
-        return True
+    # Plain functions carry their argument count in their code object, which is
+    # much cheaper to read than building an argspec.
+    code = getattr(func, '__code__', None)
+    if code is not None:
+        return code.co_argcount != 0
+    getargspec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+    func_argc = len(getargspec(func).args)
+    return func_argc != 0
@@ -37,14 +37,18 @@ from __future__ import print_function
 # System modules
 import abc
 import collections
+import errno
 from functools import wraps
 import gc
 import glob
 import inspect
 import io
+import operator
 import os.path
 import re
+import shutil
 import signal
+import struct
 from subprocess import *
 import sys
 import time
@@ -81,16 +85,18 @@ debug_confirm_directory_exclusivity = False
 # LLDB_COMMAND_TRACE and LLDB_DO_CLEANUP are set from '-t' and '-r dir' options.
 
 # By default, traceAlways is False.
-if "LLDB_COMMAND_TRACE" in os.environ and os.environ["LLDB_COMMAND_TRACE"]=="YES":
-    traceAlways = True
-else:
-    traceAlways = False
+traceAlways = os.environ.get("LLDB_COMMAND_TRACE") == "YES"
 
 # By default, doCleanup is True.
-if "LLDB_DO_CLEANUP" in os.environ and os.environ["LLDB_DO_CLEANUP"]=="NO":
-    doCleanup = False
-else:
-    doCleanup = True
+doCleanup = os.environ.get("LLDB_DO_CLEANUP") != "NO"
+
+# Overrides for TestBase.maxLaunchCount and TestBase.timeWaitNextLaunch, or None.
+maxLaunchCountOverride = os.environ.get("LLDB_MAX_LAUNCH_COUNT")
+if maxLaunchCountOverride is not None:
+    maxLaunchCountOverride = int(maxLaunchCountOverride)
+timeWaitNextLaunchOverride = os.environ.get("LLDB_TIME_WAIT_NEXT_LAUNCH")
+if timeWaitNextLaunchOverride is not None:
+    timeWaitNextLaunchOverride = float(timeWaitNextLaunchOverride)
 
 
 #
@@ -202,29 +208,55 @@ def SETTING_MSG(setting):
 
 def EnvArray():
     """Returns an env variable array from the os.environ map object."""
-    return list(map(lambda k,v: k+"="+v, list(os.environ.keys()), list(os.environ.values())))
+    return [k + "=" + v for k, v in os.environ.items()]
 
 def line_number(filename, string_to_match):
     """Helper function to return the line number of the first matched string."""
-    with io.open(filename, mode='r', encoding="utf-8") as f:
-        for i, line in enumerate(f):
-            if line.find(string_to_match) != -1:
-                # Found our match.
-                return i+1
-    raise Exception("Unable to find '%s' within file %s" % (string_to_match, filename))
+    return line_numbers(filename, [string_to_match])[0]
+
+def line_numbers(filename, strings_to_match):
+    """
+    Helper function to return the line numbers of the first matches of several
+    strings, in the order the strings are given.  The file is only read once.
+    """
+    with io.open(filename, mode='rb') as f:
+        data = f.read()
+    result = []
+    for string_to_match in strings_to_match:
+        if isinstance(string_to_match, six.text_type):
+            needle = string_to_match.encode("utf-8")
+        else:
+            needle = string_to_match
+        # Search the whole file at once and count the newlines preceding the
+        # match, rather than scanning it line by line.
+        index = data.find(needle)
+        if index == -1:
+            raise Exception("Unable to find '%s' within file %s" % (string_to_match, filename))
+        result.append(data.count(b'\n', 0, index) + 1)
+    return result
+
+_null_device = None
+
+def null_device():
+    """
+    Returns a writable file object for the null device.  It is opened once and
+    shared, so callers must not close it.
+    """
+    global _null_device
+    if _null_device is None:
+        _null_device = open(os.devnull, 'w')
+    return _null_device
 
 def pointer_size():
     """Return the pointer size of the host system."""
-    import ctypes
-    a_pointer = ctypes.c_void_p(0xffff)
-    return 8 * ctypes.sizeof(a_pointer)
+    # The size of a native pointer ("P") is fixed for the running interpreter.
+    return 8 * struct.calcsize("P")
 
 def is_exe(fpath):
     """Returns true if fpath is an executable."""
     return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
 
-def which(program):
-    """Returns the full path to a program; None otherwise."""
+def _which(program):
     fpath, fname = os.path.split(program)
     if fpath:
         if is_exe(program):
@@ -236,6 +268,23 @@ def which(program):
                 return exe_file
     return None
 
+if not six.PY2:
+    _which = shutil.which
+
+# Results of PATH lookups done by which(), keyed on the program name and the
+# PATH it was resolved against.
+_which_cache = {}
+
+def which(program):
+    """Returns the full path to a program; None otherwise."""
+    if os.path.dirname(program):
+        # Not a PATH lookup; the file may come and go, so don't cache it.
+        return _which(program)
+    key = (program, os.environ.get("PATH"))
+    if key not in _which_cache:
+        _which_cache[key] = _which(program)
+    return _which_cache[key]
+
 class recording(SixStringIO):
     """
     A nice little context manager for recording the debugger interactions into
@@ -284,6 +333,11 @@ class _BaseProcess(object):
     def terminate(self):
         """Terminates previously launched process.."""
 
+# Signals tried in turn by _LocalProcess.terminate(), limited to the ones the
+# host platform defines.
+_termination_signals = tuple(getattr(signal, sig) for sig in ('SIGHUP', 'SIGCONT', 'SIGINT')
+                             if hasattr(signal, sig))
+
 class _LocalProcess(_BaseProcess):
 
     def __init__(self, trace_on):
@@ -297,27 +351,39 @@ class _LocalProcess(_BaseProcess):
 
     def launch(self, executable, args):
         self._proc = Popen([executable] + args,
-                           stdout = open(os.devnull) if not self._trace_on else None,
+                           stdout = null_device() if not self._trace_on else None,
                            stdin = PIPE)
 
+    def _wait_for_exit(self):
+        """
+        Wait up to self._delayafterterminate seconds for _proc to exit.
+        Returns True if it has exited.
+        """
+        if six.PY2:
+            # Popen.wait() doesn't support a timeout before Python 3.3.
+            time.sleep(self._delayafterterminate)
+            return self._proc.poll() is not None
+        try:
+            self._proc.wait(timeout=self._delayafterterminate)
+            return True
+        except TimeoutExpired:
+            return False
+
     def terminate(self):
-        if self._proc.poll() == None:
+        if self._proc.poll() is None:
             # Terminate _proc like it does the pexpect
-            signals_to_try = [sig for sig in ['SIGHUP', 'SIGCONT', 'SIGINT'] if sig in dir(signal)]
-            for sig in signals_to_try:
+            for sig in _termination_signals:
                 try:
-                    self._proc.send_signal(getattr(signal, sig))
-                    time.sleep(self._delayafterterminate)
-                    if self._proc.poll() != None:
+                    self._proc.send_signal(sig)
+                    if self._wait_for_exit():
                         return
                 except ValueError:
                     pass  # Windows says SIGINT is not a valid signal to send
             self._proc.terminate()
-            time.sleep(self._delayafterterminate)
-            if self._proc.poll() != None:
+            if self._wait_for_exit():
                 return
             self._proc.kill()
-            time.sleep(self._delayafterterminate)
+            self._wait_for_exit()
 
     def poll(self):
         return self._proc.poll()
@@ -361,6 +427,24 @@ class _RemoteProcess(_BaseProcess):
     def terminate(self):
         lldb.remote_platform.Kill(self._pid)
 
+# Characters the shell would split, quote, expand or redirect on.
+_shell_special_chars = frozenset(' \t\n|&;<>()$`\\"\'*?[]{}#~')
+
+def _argv_without_shell(command):
+    """
+    Returns the argument list of command if it means the same thing with or
+    without a shell, so that it can be run directly.  Otherwise returns None.
+    """
+    # Empty arguments vanish when the shell splits the joined command line.
+    argv = [arg for arg in command if arg]
+    if not argv or '=' in argv[0]:
+        # A leading NAME=value is a shell variable assignment.
+        return None
+    for arg in argv:
+        if not _shell_special_chars.isdisjoint(arg):
+            return None
+    return argv
+
 # From 2.7's subprocess.check_output() convenience function.
 # Return a tuple (stdoutdata, stderrdata).
 def system(commands, **kwargs):
@@ -387,19 +471,36 @@ def system(commands, **kwargs):
     # Assign the sender object to variable 'test' and remove it from kwargs.
     test = kwargs.pop('sender', None)
 
+    # If the commands don't depend on each other, the caller can ask for all of
+    # them to be started at once.  Their output is still collected in order.
+    parallel = kwargs.pop('parallel', False)
+
+    if 'stdout' in kwargs:
+        raise ValueError('stdout argument not allowed, it will be overridden.')
+    if kwargs.pop('shell', True)==False:
+        raise ValueError('shell=False not allowed')
+
+    def launch(command, shellCommand):
+        argv = _argv_without_shell(command)
+        if argv is not None:
+            try:
+                return Popen(argv, stdout=PIPE, stderr=PIPE, universal_newlines=True, **kwargs)
+            except OSError:
+                # Let the shell report a missing program as it always has.
+                pass
+        return Popen(shellCommand, stdout=PIPE, stderr=PIPE, shell=True, universal_newlines=True, **kwargs)
+
     # [['make', 'clean', 'foo'], ['make', 'foo']] -> ['make clean foo', 'make foo']
     commandList = [' '.join(x) for x in commands]
-    output = ""
-    error = ""
-    for shellCommand in commandList:
-        if 'stdout' in kwargs:
-            raise ValueError('stdout argument not allowed, it will be overridden.')
-        if 'shell' in kwargs and kwargs['shell']==False:
-            raise ValueError('shell=False not allowed')
-        process = Popen(shellCommand, stdout=PIPE, stderr=PIPE, shell=True, universal_newlines=True, **kwargs)
+    if parallel:
+        processes = [launch(command, shellCommand) for command, shellCommand in zip(commands, commandList)]
+    output = []
+    error = []
+    for i, shellCommand in enumerate(commandList):
+        process = processes[i] if parallel else launch(commands[i], shellCommand)
         pid = process.pid
         this_output, this_error = process.communicate()
-        retcode = process.poll()
+        retcode = process.returncode
 
         # Enable trace on failure return while tracking down FreeBSD buildbot issues
         trace = traceAlways
@@ -426,23 +527,37 @@ def system(commands, **kwargs):
                 "stderr_content": this_error,
                 "command": shellCommand
             }
+            if parallel:
+                # Don't leave the remaining commands running behind our back.
+                for remaining in processes[i+1:]:
+                    remaining.communicate()
             raise cpe
-        output = output + this_output
-        error = error + this_error
-    return (output, error)
+        output.append(this_output)
+        error.append(this_error)
+    return ("".join(output), "".join(error))
+
+# Source text of functions seen by getsource_if_available(), keyed on their
+# code object.  Closures and lambdas created from the same definition share a
+# code object and therefore the same source.
+_source_cache = {}
 
 def getsource_if_available(obj):
     """
     Return the text of the source code for an object if available.  Otherwise,
     a print representation is returned.
     """
-    import inspect
+    code = getattr(obj, "__code__", None)
+    if code is not None and code in _source_cache:
+        return _source_cache[code]
     try:
-        return inspect.getsource(obj)
+        source = inspect.getsource(obj)
     except:
         return repr(obj)
+    if code is not None:
+        _source_cache[code] = source
+    return source
 
-def builder_module():
+def _import_builder_module():
     if sys.platform.startswith("freebsd"):
         return __import__("builder_freebsd")
     if sys.platform.startswith("netbsd"):
@@ -453,6 +568,158 @@ def builder_module():
         return __import__("builder_linux")
     return __import__("builder_" + sys.platform)
 
+# The builder plugin only depends on the host platform, so it is resolved once
+# on first use.  It cannot be imported eagerly because the test driver adds the
+# plugins directory to sys.path after this module has been loaded.
+_builder_module = None
+
+def builder_module():
+    global _builder_module
+    if _builder_module is None:
+        _builder_module = _import_builder_module()
+    return _builder_module
+
+# The log channels are configured once by the test driver, so they only need
+# to be parsed once rather than for every test.
+_parsed_log_channels = (None, [])
+
+_LogChannel = collections.namedtuple("_LogChannel",
+        ["channel_with_categories", "channel", "categories", "disable_command"])
+
+def _parse_log_channels():
+    """
+    Returns a list of _LogChannel tuples for the channels in
+    lldbtest_config.channels.
+
+    The channel format is <channel-name> [<category0> [<category1> ...]];
+    categories is "default" if none were specified.  The 'log disable' command
+    for the channel is prepared up front as well.  LLDB's log commands take a
+    single channel each, so they can't be combined into one command.
+    """
+    global _parsed_log_channels
+    channels, parsed = _parsed_log_channels
+    if channels != lldbtest_config.channels:
+        channels = list(lldbtest_config.channels)
+        parsed = []
+        for channel_with_categories in channels:
+            channel_then_categories = channel_with_categories.split(' ', 1)
+            channel = channel_then_categories[0]
+            if len(channel_then_categories) > 1:
+                categories = channel_then_categories[1]
+            else:
+                categories = "default"
+            parsed.append(_LogChannel(channel_with_categories, channel, categories,
+                                      "log disable " + channel))
+        _parsed_log_channels = (channels, parsed)
+    return parsed
+
+def _compiler_log_basename_components(test):
+    """Splits the compiler path into log basename components."""
+    compiler = test.getCompiler()
+
+    if compiler[1] == ':':
+        compiler = compiler[2:]
+    if os.path.altsep is not None:
+        compiler = compiler.replace(os.path.altsep, os.path.sep)
+    return [x for x in compiler.split(os.path.sep) if x != ""]
+
+# Maps each configuration.session_file_format character to a function that
+# returns the log basename components it stands for.
+_log_basename_component_functions = {
+    'f': lambda test: [test.__class__.__module__],
+    'n': lambda test: [test.__class__.__name__],
+    'c': _compiler_log_basename_components,
+    'a': lambda test: [test.getArchitecture()],
+    'm': lambda test: [test.testMethodName],
+}
+
+_session_file_format_plan = (None, [])
+
+def _get_session_file_format_plan():
+    """
+    Returns the list of component functions for
+    configuration.session_file_format.  The format doesn't change during a
+    test run, so it is only translated again if it does.
+    """
+    global _session_file_format_plan
+    session_file_format, plan = _session_file_format_plan
+    if session_file_format != configuration.session_file_format:
+        session_file_format = configuration.session_file_format
+        plan = [_log_basename_component_functions[c] for c in session_file_format
+                if c in _log_basename_component_functions]
+        _session_file_format_plan = (session_file_format, plan)
+    return plan
+
+# Compiler versions and lldb architectures keyed on the binary they were
+# queried from.  These don't change during a test run, and computing them
+# spawns a process.
+_compiler_versions = {}
+_go_compiler_versions = {}
+_lldb_architectures = {}
+
+# Patterns used to pick the above out of the tools' output.
+_compiler_version_regex = re.compile(r'version ([0-9.]+)')
+_go_compiler_version_regex = re.compile(r'go version (devel|go\S+)')
+# lldb's output is searched as bytes, so only the match itself is decoded.
+_lldb_architecture_regex = re.compile(b"Current executable set to '.*' \\((.*)\\)\\.")
+
+# Patterns used by TestBase.expect(), match() and
+# switch_to_thread_with_stop_reason(), compiled.  The same patterns come up over
+# and over during a run, so they are kept here rather than left to the re
+# module's smaller cache.  Like re's own cache, it is simply emptied once it
+# holds _max_compiled_patterns entries, since callers also build patterns from
+# one-off values such as addresses.
+_compiled_patterns = {}
+_max_compiled_patterns = 2048
+
+def _compile_pattern(pattern):
+    compiled = _compiled_patterns.get(pattern)
+    if compiled is None:
+        if len(_compiled_patterns) >= _max_compiled_patterns:
+            _compiled_patterns.clear()
+        compiled = _compiled_patterns[pattern] = re.compile(pattern)
+    return compiled
+
+# Results of Base.getBuildFlags(), keyed on its arguments and the platform
+# and compiler in use.
+_build_flags = {}
+
+# Categories read from .categories files by TestBase.getCategories(), keyed on
+# every folder the lookup passed through on the way to the file.
+_categories_cache = {}
+
+# Folders holding the test classes' source files, keyed on the class.
+_test_folders = {}
+
+# Ordering operators accepted by Base.expectedCompilerVersion().
+_version_comparisons = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '=>': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '=<': operator.le,
+}
+
+# Names of the Base methods TestBase.build() uses for each debug info format.
+_build_methods = {
+    None: 'buildDefault',
+    'dsym': 'buildDsym',
+    'dwarf': 'buildDwarf',
+    'dwo': 'buildDwo',
+}
+
+def _version_key(version):
+    """
+    Returns a key that orders dotted version strings numerically, so that e.g.
+    "3.10" sorts after "3.9".  Anything else (such as "unknown") is compared as
+    a plain string, as before.
+    """
+    version = str(version)
+    if re.match(r"^[0-9]+(\.[0-9]+)*$", version):
+        return (0, tuple(int(x) for x in version.split('.')))
+    return (1, version)
+
 
 class Base(unittest2.TestCase):
     """
@@ -468,6 +735,10 @@ class Base(unittest2.TestCase):
     # Keep track of the old current working directory.
     oldcwd = None
 
+    # Remote working directories of the tests in this class, whose files are
+    # removed in tearDownClass().  Created by the first test that needs it.
+    remoteWorkingDirs = None
+
     @staticmethod
     def compute_mydir(test_file):
         '''Subclasses should call this function to correctly calculate the required "mydir" attribute as follows: 
@@ -495,11 +766,12 @@ class Base(unittest2.TestCase):
 
         # Change current working directory if ${LLDB_TEST} is defined.
         # See also dotest.py which sets up ${LLDB_TEST}.
-        if ("LLDB_TEST" in os.environ):
-            full_dir = os.path.join(os.environ["LLDB_TEST"], cls.mydir)
+        lldb_test = os.environ.get("LLDB_TEST")
+        if lldb_test is not None:
+            full_dir = os.path.join(lldb_test, cls.mydir)
             if traceAlways:
                 print("Change dir to:", full_dir, file=sys.stderr)
-            os.chdir(os.path.join(os.environ["LLDB_TEST"], cls.mydir))
+            os.chdir(full_dir)
 
         if debug_confirm_directory_exclusivity:
             import lock
@@ -527,20 +799,35 @@ class Base(unittest2.TestCase):
         Do class-wide cleanup.
         """
 
-        if doCleanup:
-            # First, let's do the platform-specific cleanup.
-            module = builder_module()
-            module.cleanup()
-
-            # Subclass might have specific cleanup function defined.
-            if getattr(cls, "classCleanup", None):
-                if traceAlways:
-                    print("Call class-specific cleanup function for class:", cls, file=sys.stderr)
-                try:
-                    cls.classCleanup()
-                except:
-                    exc_type, exc_value, exc_tb = sys.exc_info()
-                    traceback.print_exception(exc_type, exc_value, exc_tb)
+        try:
+            if doCleanup:
+                # First, let's do the platform-specific cleanup.
+                module = builder_module()
+                module.cleanup()
+
+                # Subclass might have specific cleanup function defined.
+                if getattr(cls, "classCleanup", None):
+                    if traceAlways:
+                        print("Call class-specific cleanup function for class:", cls, file=sys.stderr)
+                    try:
+                        cls.classCleanup()
+                    except:
+                        exc_type, exc_value, exc_tb = sys.exc_info()
+                        traceback.print_exception(exc_type, exc_value, exc_tb)
+        finally:
+            # Remove all files from the remote working directories of the tests with
+            # one remote command, while leaving the directories in place. The cleanup
+            # is required to reduce the disk space required by the test suite while
+            # leaving the directories untouched is necessary because sub-directories
+            # might belong to another test.
+            if cls.remoteWorkingDirs:
+                # TODO: Make it working on Windows when we need it for remote debugging support
+                # TODO: Replace the heuristic to remove the files with a logic what collects the
+                # list of files we have to remove during test runs.
+                shell_cmd = lldb.SBPlatformShellCommand(
+                        "rm " + " ".join("%s/*" % remote_dir for remote_dir in cls.remoteWorkingDirs))
+                lldb.remote_platform.Run(shell_cmd)
+                cls.remoteWorkingDirs = None
 
         if debug_confirm_directory_exclusivity:
             cls.dir_lock.release()
@@ -557,10 +844,7 @@ class Base(unittest2.TestCase):
         By default, we skip long running test case.
         This can be overridden by passing '-l' to the test driver (dotest.py).
         """
-        if "LLDB_SKIP_LONG_RUNNING_TEST" in os.environ and "NO" == os.environ["LLDB_SKIP_LONG_RUNNING_TEST"]:
-            return False
-        else:
-            return True
+        return os.environ.get("LLDB_SKIP_LONG_RUNNING_TEST") != "NO"
 
     def enableLogChannelsForCurrentTest(self):
         if len(lldbtest_config.channels) == 0:
@@ -575,19 +859,12 @@ class Base(unittest2.TestCase):
         open(host_log_path, 'w').close()
 
         log_enable = "log enable -Tpn -f {} ".format(host_log_path)
-        for channel_with_categories in lldbtest_config.channels:
-            channel_then_categories = channel_with_categories.split(' ', 1)
-            channel = channel_then_categories[0]
-            if len(channel_then_categories) > 1:
-                categories = channel_then_categories[1]
-            else:
-                categories = "default"
-
-            if channel == "gdb-remote":
+        for log_channel in _parse_log_channels():
+            if log_channel.channel == "gdb-remote":
                 # communicate gdb-remote categories to debugserver
-                os.environ["LLDB_DEBUGSERVER_LOG_FLAGS"] = categories
+                os.environ["LLDB_DEBUGSERVER_LOG_FLAGS"] = log_channel.categories
 
-            self.ci.HandleCommand(log_enable + channel_with_categories, self.res)
+            self.ci.HandleCommand(log_enable + log_channel.channel_with_categories, self.res)
             if not self.res.Succeeded():
                 raise Exception('log enable failed (check LLDB_LOG_OPTION env variable)')
 
@@ -604,10 +881,8 @@ class Base(unittest2.TestCase):
 
     def disableLogChannelsForCurrentTest(self):
         # close all log files that we opened
-        for channel_and_categories in lldbtest_config.channels:
-            # channel format - <channel-name> [<category0> [<category1> ...]]
-            channel = channel_and_categories.split(' ', 1)[0]
-            self.ci.HandleCommand("log disable " + channel, self.res)
+        for log_channel in _parse_log_channels():
+            self.ci.HandleCommand(log_channel.disable_command, self.res)
             if not self.res.Succeeded():
                 raise Exception('log disable failed (check LLDB_LOG_OPTION env variable)')
 
@@ -619,19 +894,17 @@ class Base(unittest2.TestCase):
         #import traceback
         #traceback.print_stack()
 
-        if "LIBCXX_PATH" in os.environ:
-            self.libcxxPath = os.environ["LIBCXX_PATH"]
-        else:
-            self.libcxxPath = None
+        # The same test instance is run once per architecture and compiler, so
+        # the log basename has to be worked out afresh for each run.
+        self._log_basename_parts = None
 
-        if "LLDBMI_EXEC" in os.environ:
-            self.lldbMiExec = os.environ["LLDBMI_EXEC"]
-        else:
-            self.lldbMiExec = None
+        self.libcxxPath = os.environ.get("LIBCXX_PATH")
+
+        self.lldbMiExec = os.environ.get("LLDBMI_EXEC")
 
         # If we spawn an lldb process for test (via pexpect), do not load the
         # init file unless told otherwise.
-        if "NO_LLDBINIT" in os.environ and "NO" == os.environ["NO_LLDBINIT"]:
+        if os.environ.get("NO_LLDBINIT") == "NO":
             self.lldbOption = ""
         else:
             self.lldbOption = "--no-lldbinit"
@@ -735,8 +1008,11 @@ class Base(unittest2.TestCase):
         del self.subprocesses[:]
         # Ensure any forked processes are cleaned up
         for pid in self.forkedProcessPids:
-            if os.path.exists("/proc/" + str(pid)):
+            try:
                 os.kill(pid, signal.SIGTERM)
+            except OSError:
+                # The process is already gone.
+                pass
 
     def spawnSubprocess(self, executable, args=[], install_remote=True):
         """ Creates a subprocess.Popen object with the specified executable and arguments,
@@ -796,7 +1072,7 @@ class Base(unittest2.TestCase):
 
         self.sys_stdout_hidden = True
         old_stdout = sys.stdout
-        sys.stdout = open(os.devnull, 'w')
+        sys.stdout = null_device()
         def restore_stdout():
             sys.stdout = old_stdout
         self.addTearDownHook(restore_stdout)
@@ -822,9 +1098,12 @@ class Base(unittest2.TestCase):
         Hooks are executed in a first come first serve manner.
         """
         if six.callable(hook):
+            source = getsource_if_available(hook)
             with recording(self, traceAlways) as sbuf:
-                print("Adding tearDown hook:", getsource_if_available(hook), file=sbuf)
-            self.hooks.append(hook)
+                print("Adding tearDown hook:", source, file=sbuf)
+            # Remember how to call the hook, and its source for the session log,
+            # so tearDown() doesn't have to work them out again.
+            self.hooks.append((hook, funcutils.requires_self(hook), source))
         
         return self
 
@@ -846,13 +1125,22 @@ class Base(unittest2.TestCase):
                 # child is already terminated
                 pass
             except OSError as exception:
-                import errno
                 if exception.errno != errno.EIO:
                     # unexpected error
                     raise
                 # child is already terminated
                 pass
             finally:
+                # pexpect's close() sleeps for delayafterclose before checking
+                # whether the child has exited.  Poll for the exit within that
+                # time instead, so a child that quits promptly doesn't cost the
+                # full delay.  isalive() reaps the child once it is gone.  Newer
+                # pexpect versions delegate close() to a ptyprocess object.
+                closer = getattr(self.child, 'ptyproc', self.child)
+                deadline = time.time() + closer.delayafterclose
+                while self.child.isalive() and time.time() < deadline:
+                    time.sleep(0.01)
+                closer.delayafterclose = 0
                 # Give it one final blow to make sure the child is terminated.
                 self.child.close()
 
@@ -864,10 +1152,10 @@ class Base(unittest2.TestCase):
         self.deletePexpectChild()
 
         # Check and run any hook functions.
-        for hook in reversed(self.hooks):
+        for hook, hook_requires_self, source in reversed(self.hooks):
             with recording(self, traceAlways) as sbuf:
-                print("Executing tearDown hook:", getsource_if_available(hook), file=sbuf)
-            if funcutils.requires_self(hook):
+                print("Executing tearDown hook:", source, file=sbuf)
+            if hook_requires_self:
                 hook(self)
             else:
                 hook() # try the plain call and hope it works
@@ -890,62 +1178,59 @@ class Base(unittest2.TestCase):
     # Various callbacks to allow introspection of test progress
     # =========================================================
 
+    def _record(self, message, trace=False):
+        """
+        Records message like 'with recording(self, trace)' would: into the
+        session object and, if trace is ON, into the stderr.  Saves setting up a
+        SixStringIO for messages which are ready-made strings.
+        """
+        if trace:
+            print(message + "\n", file=sys.stderr)
+        # The test might not have undergone the 'setUp(self)' phase yet, so that
+        # the attribute 'session' might not even exist yet.
+        session = getattr(self, "session", None)
+        if session:
+            print(message + "\n", file=session)
+
+    # The outcomes are not traced, because there's no need to write them to the
+    # stderr twice.  Once by the Python unittest framework, and a second time by
+    # us.
+
     def markError(self):
         """Callback invoked when an error (unexpected exception) errored."""
         self.__errored__ = True
-        with recording(self, False) as sbuf:
-            # False because there's no need to write "ERROR" to the stderr twice.
-            # Once by the Python unittest framework, and a second time by us.
-            print("ERROR", file=sbuf)
+        self._record("ERROR")
 
     def markCleanupError(self):
         """Callback invoked when an error occurs while a test is cleaning up."""
         self.__cleanup_errored__ = True
-        with recording(self, False) as sbuf:
-            # False because there's no need to write "CLEANUP_ERROR" to the stderr twice.
-            # Once by the Python unittest framework, and a second time by us.
-            print("CLEANUP_ERROR", file=sbuf)
+        self._record("CLEANUP_ERROR")
 
     def markFailure(self):
         """Callback invoked when a failure (test assertion failure) occurred."""
         self.__failed__ = True
-        with recording(self, False) as sbuf:
-            # False because there's no need to write "FAIL" to the stderr twice.
-            # Once by the Python unittest framework, and a second time by us.
-            print("FAIL", file=sbuf)
+        self._record("FAIL")
 
     def markExpectedFailure(self,err,bugnumber):
         """Callback invoked when an expected failure/error occurred."""
         self.__expected__ = True
-        with recording(self, False) as sbuf:
-            # False because there's no need to write "expected failure" to the
-            # stderr twice.
-            # Once by the Python unittest framework, and a second time by us.
-            if bugnumber == None:
-                print("expected failure", file=sbuf)
-            else:
-                print("expected failure (problem id:" + str(bugnumber) + ")", file=sbuf)
+        if bugnumber == None:
+            self._record("expected failure")
+        else:
+            self._record("expected failure (problem id:" + str(bugnumber) + ")")
 
     def markSkippedTest(self):
         """Callback invoked when a test is skipped."""
         self.__skipped__ = True
-        with recording(self, False) as sbuf:
-            # False because there's no need to write "skipped test" to the
-            # stderr twice.
-            # Once by the Python unittest framework, and a second time by us.
-            print("skipped test", file=sbuf)
+        self._record("skipped test")
 
     def markUnexpectedSuccess(self, bugnumber):
         """Callback invoked when an unexpected success occurred."""
         self.__unexpected__ = True
-        with recording(self, False) as sbuf:
-            # False because there's no need to write "unexpected success" to the
-            # stderr twice.
-            # Once by the Python unittest framework, and a second time by us.
-            if bugnumber == None:
-                print("unexpected success", file=sbuf)
-            else:
-                print("unexpected success (problem id:" + str(bugnumber) + ")", file=sbuf)
+        if bugnumber == None:
+            self._record("unexpected success")
+        else:
+            self._record("unexpected success (problem id:" + str(bugnumber) + ")")
 
     def getRerunArgs(self):
         return " -f %s.%s" % (self.__class__.__name__, self._testMethodName)
@@ -957,31 +1242,23 @@ class Base(unittest2.TestCase):
 
         <session-dir>/<arch>-<compiler>-<test-file>.<test-class>.<test-method>
         """
-        dname = os.path.join(os.environ["LLDB_TEST"],
-                     os.environ["LLDB_SESSION_DIRNAME"])
-        if not os.path.isdir(dname):
-            os.mkdir(dname)
-
-        components = []
+        # Everything but the prefix stays the same for the whole test, so it is
+        # only worked out (and the session directory created) once.
+        log_basename_parts = getattr(self, "_log_basename_parts", None)
+        if log_basename_parts is None:
+            dname = os.path.join(os.environ["LLDB_TEST"],
+                         os.environ["LLDB_SESSION_DIRNAME"])
+            if not os.path.isdir(dname):
+                os.mkdir(dname)
+
+            components = []
+            for component_function in _get_session_file_format_plan():
+                components.extend(component_function(self))
+            log_basename_parts = self._log_basename_parts = (dname, components)
+
+        dname, components = log_basename_parts
         if prefix is not None:
-            components.append(prefix)
-        for c in configuration.session_file_format:
-            if c == 'f':
-                components.append(self.__class__.__module__)
-            elif c == 'n':
-                components.append(self.__class__.__name__)
-            elif c == 'c':
-                compiler = self.getCompiler()
-
-                if compiler[1] == ':':
-                    compiler = compiler[2:]
-                if os.path.altsep is not None:
-                    compiler = compiler.replace(os.path.altsep, os.path.sep)
-                components.extend([x for x in compiler.split(os.path.sep) if x != ""])
-            elif c == 'a':
-                components.append(self.getArchitecture())
-            elif c == 'm':
-                components.append(self.testMethodName)
+            components = [prefix] + components
         fname = "-".join(components)
 
         return os.path.join(dname, fname)
@@ -1028,44 +1305,42 @@ class Base(unittest2.TestCase):
         else:
             prefix = 'Success'
 
-        if not self.__unexpected__ and not self.__skipped__:
+        # The log files of a successful test are deleted below unless asked to
+        # keep them.  When they are going to be deleted, there's no point in
+        # adding the traceback and the footer to the session.
+        keep_logs = prefix != 'Success' or lldbtest_config.log_success
+
+        if keep_logs and not self.__unexpected__ and not self.__skipped__:
             for test, traceback in pairs:
                 if test is self:
                     print(traceback, file=self.session)
 
-        # put footer (timestamp/rerun instructions) into session
-        testMethod = getattr(self, self._testMethodName)
-        if getattr(testMethod, "__benchmarks_test__", False):
-            benchmarks = True
-        else:
-            benchmarks = False
-
-        import datetime
-        print("Session info generated @", datetime.datetime.now().ctime(), file=self.session)
-        print("To rerun this test, issue the following command from the 'test' directory:\n", file=self.session)
-        print("./dotest.py %s -v %s %s" % (self.getRunOptions(),
-                                                 ('+b' if benchmarks else '-t'),
-                                                 self.getRerunArgs()), file=self.session)
+        if keep_logs:
+            # put footer (timestamp/rerun instructions) into session
+            testMethod = getattr(self, self._testMethodName)
+            if getattr(testMethod, "__benchmarks_test__", False):
+                benchmarks = True
+            else:
+                benchmarks = False
+
+            import datetime
+            print("Session info generated @", datetime.datetime.now().ctime(), file=self.session)
+            print("To rerun this test, issue the following command from the 'test' directory:\n", file=self.session)
+            print("./dotest.py %s -v %s %s" % (self.getRunOptions(),
+                                                     ('+b' if benchmarks else '-t'),
+                                                     self.getRerunArgs()), file=self.session)
         self.session.close()
         del self.session
 
         # process the log files
-        log_files_for_this_test = glob.glob(self.log_basename + "*")
+        log_files_for_this_test = find_log_files(self.log_basename)
 
-        if prefix != 'Success' or lldbtest_config.log_success:
+        if keep_logs:
             # keep all log files, rename them to include prefix
             dst_log_basename = self.getLogBasenameForCurrentTest(prefix)
             for src in log_files_for_this_test:
-                if os.path.isfile(src):
-                    dst = src.replace(self.log_basename, dst_log_basename)
-                    if os.name == "nt" and os.path.isfile(dst):
-                        # On Windows, renaming a -> b will throw an exception if b exists.  On non-Windows platforms
-                        # it silently replaces the destination.  Ultimately this means that atomic renames are not
-                        # guaranteed to be possible on Windows, but we need this to work anyway, so just remove the
-                        # destination first if it already exists.
-                        remove_file(dst)
-
-                    os.rename(src, dst)
+                dst = src.replace(self.log_basename, dst_log_basename)
+                replace_file(src, dst)
         else:
             # success!  (and we don't want log files) delete log files
             for log_file in log_files_for_this_test:
@@ -1087,24 +1362,27 @@ class Base(unittest2.TestCase):
     def getLldbArchitecture(self):
         """Returns the architecture of the lldb binary."""
         if not hasattr(self, 'lldbArchitecture'):
-
-            # spawn local process
-            command = [
-                lldbtest_config.lldbExec,
-                "-o",
-                "file " + lldbtest_config.lldbExec,
-                "-o",
-                "quit"
-            ]
-
-            output = check_output(command)
-            str = output.decode("utf-8");
-
-            for line in str.splitlines():
-                m = re.search("Current executable set to '.*' \\((.*)\\)\\.", line)
+            # The architecture only depends on the lldb binary, so it's shared by
+            # all tests.
+            if lldbtest_config.lldbExec not in _lldb_architectures:
+
+                # spawn local process
+                command = [
+                    lldbtest_config.lldbExec,
+                    "-o",
+                    "file " + lldbtest_config.lldbExec,
+                    "-o",
+                    "quit"
+                ]
+
+                output = check_output(command)
+
+                m = _lldb_architecture_regex.search(output)
                 if m:
-                    self.lldbArchitecture = m.group(1)
-                    break
+                    _lldb_architectures[lldbtest_config.lldbExec] = m.group(1).decode("utf-8")
+
+            if lldbtest_config.lldbExec in _lldb_architectures:
+                self.lldbArchitecture = _lldb_architectures[lldbtest_config.lldbExec]
 
         return self.lldbArchitecture
 
@@ -1121,27 +1399,30 @@ class Base(unittest2.TestCase):
         """ Returns a string that represents the compiler version.
             Supports: llvm, clang.
         """
-        version = 'unknown'
-
         compiler = self.getCompilerBinary()
-        version_output = system([[compiler, "-v"]])[1]
-        for line in version_output.split(os.linesep):
-            m = re.search('version ([0-9\.]+)', line)
-            if m:
-                version = m.group(1)
-        return version
+        if compiler not in _compiler_versions:
+            version = 'unknown'
+            version_output = system([[compiler, "-v"]])[1]
+            # Use the last version string reported.
+            versions = _compiler_version_regex.findall(version_output)
+            if versions:
+                version = versions[-1]
+            _compiler_versions[compiler] = version
+        return _compiler_versions[compiler]
 
     def getGoCompilerVersion(self):
         """ Returns a string that represents the go compiler version, or None if go is not found.
         """
         compiler = which("go")
-        if compiler:
-            version_output = system([[compiler, "version"]])[0]
-            for line in version_output.split(os.linesep):
-                m = re.search('go version (devel|go\\S+)', line)
+        if compiler not in _go_compiler_versions:
+            version = None
+            if compiler:
+                version_output = system([[compiler, "version"]])[0]
+                m = _go_compiler_version_regex.search(version_output)
                 if m:
-                    return m.group(1)
-        return None
+                    version = m.group(1)
+            _go_compiler_versions[compiler] = version
+        return _go_compiler_versions[compiler]
 
     def platformIsDarwin(self):
         """Returns true if the OS triple for the selected platform is any valid apple OS"""
@@ -1163,20 +1444,15 @@ class Base(unittest2.TestCase):
         """
         if (compiler_version == None):
             return True
-        operator = str(compiler_version[0])
+        op = str(compiler_version[0])
         version = compiler_version[1]
 
         if (version == None):
             return True
-        if (operator == '>'):
-            return self.getCompilerVersion() > version
-        if (operator == '>=' or operator == '=>'): 
-            return self.getCompilerVersion() >= version
-        if (operator == '<'):
-            return self.getCompilerVersion() < version
-        if (operator == '<=' or operator == '=<'):
-            return self.getCompilerVersion() <= version
-        if (operator == '!=' or operator == '!' or operator == 'not'):
+        if op in _version_comparisons:
+            return _version_comparisons[op](_version_key(self.getCompilerVersion()),
+                                            _version_key(version))
+        if op in ('!=', '!', 'not'):
             return str(version) not in str(self.getCompilerVersion())
         return str(version) in str(self.getCompilerVersion())
 
@@ -1364,34 +1640,45 @@ class Base(unittest2.TestCase):
         """ Returns a dictionary (which can be provided to build* functions above) which
             contains OS-specific build flags.
         """
-        cflags = ""
-        ldflags = ""
-
-        # On Mac OS X, unless specifically requested to use libstdc++, use libc++
-        if not use_libstdcxx and self.platformIsDarwin():
-            use_libcxx = True
-
-        if use_libcxx and self.libcxxPath:
-            cflags += "-stdlib=libc++ "
-            if self.libcxxPath:
-                libcxxInclude = os.path.join(self.libcxxPath, "include")
-                libcxxLib = os.path.join(self.libcxxPath, "lib")
-                if os.path.isdir(libcxxInclude) and os.path.isdir(libcxxLib):
-                    cflags += "-nostdinc++ -I%s -L%s -Wl,-rpath,%s " % (libcxxInclude, libcxxLib, libcxxLib)
-
-        if use_cpp11:
-            cflags += "-std="
-            if "gcc" in self.getCompiler() and "4.6" in self.getCompilerVersion():
-                cflags += "c++0x"
-            else:
-                cflags += "c++11"
-        if self.platformIsDarwin() or self.getPlatform() == "freebsd":
-            cflags += " -stdlib=libc++"
-        elif self.getPlatform() == "netbsd":
-            cflags += " -stdlib=libstdc++"
-        elif "clang" in self.getCompiler():
-            cflags += " -stdlib=libstdc++"
+        platform = self.getPlatform()
+        is_darwin = self.platformIsDarwin()
+        compiler = self.getCompiler()
+
+        # The flags only depend on the arguments, the platform and the compiler,
+        # so they are worked out once per combination.
+        key = (use_cpp11, use_libcxx, use_libstdcxx, self.libcxxPath, platform, is_darwin, compiler)
+        if key not in _build_flags:
+            cflags = ""
+            ldflags = ""
+
+            # On Mac OS X, unless specifically requested to use libstdc++, use libc++
+            if not use_libstdcxx and is_darwin:
+                use_libcxx = True
+
+            if use_libcxx and self.libcxxPath:
+                cflags += "-stdlib=libc++ "
+                if self.libcxxPath:
+                    libcxxInclude = os.path.join(self.libcxxPath, "include")
+                    libcxxLib = os.path.join(self.libcxxPath, "lib")
+                    if os.path.isdir(libcxxInclude) and os.path.isdir(libcxxLib):
+                        cflags += "-nostdinc++ -I%s -L%s -Wl,-rpath,%s " % (libcxxInclude, libcxxLib, libcxxLib)
+
+            if use_cpp11:
+                cflags += "-std="
+                if "gcc" in compiler and "4.6" in self.getCompilerVersion():
+                    cflags += "c++0x"
+                else:
+                    cflags += "c++11"
+            if is_darwin or platform == "freebsd":
+                cflags += " -stdlib=libc++"
+            elif platform == "netbsd":
+                cflags += " -stdlib=libstdc++"
+            elif "clang" in compiler:
+                cflags += " -stdlib=libstdc++"
 
+            _build_flags[key] = (cflags, ldflags)
+
+        cflags, ldflags = _build_flags[key]
         return {'CFLAGS_EXTRAS' : cflags,
                 'LD_EXTRAS' : ldflags,
                }
@@ -1408,7 +1695,7 @@ class Base(unittest2.TestCase):
             library. If an environment variable named self.dylibPath is already set,
             the new path is appended to it and returned.
         """
-        existing_library_path = os.environ[self.dylibPath] if self.dylibPath in os.environ else None
+        existing_library_path = os.environ.get(self.dylibPath)
         lib_dir = os.environ["LLDB_LIB_DIR"]
         if existing_library_path:
             return "%s:%s" % (existing_library_path, lib_dir)
@@ -1423,6 +1710,19 @@ class Base(unittest2.TestCase):
         else:
             return ['libc++.1.dylib','libc++abi.dylib']
 
+def _debug_info_test_method(name, test_method, debug_info):
+    """
+    Returns a variant of test_method named name which runs with the given debug
+    info.
+    """
+    @decorators.add_test_categories([debug_info])
+    @wraps(test_method)
+    def debug_info_test_method(self):
+        self.debug_info = debug_info
+        return test_method(self)
+    debug_info_test_method.__name__ = name
+    return debug_info_test_method
+
 # Metaclass for TestBase to change the list of test metods when a new TestCase is loaded.
 # We change the test methods to create a new test method for each test for each debug info we are
 # testing. The name of the new test method will be '<original-name>_<debug-info>' and with adding
@@ -1435,49 +1735,31 @@ class LLDBTestCaseFactory(type):
         if original_testcase.NO_DEBUG_INFO_TESTCASE:
             return original_testcase
 
+        # Only look up the platform once the class turns out to have tests; base
+        # classes are created before the debugger exists.  Which debug info
+        # formats it supports is the same for every test of the class.
+        supported_categories = None
+        all_dbginfo_categories = set(test_categories.debug_info_categories)
+
         newattrs = {}
         for attrname, attrvalue in attrs.items():
             if attrname.startswith("test") and not getattr(attrvalue, "__no_debug_info_test__", False):
-                target_platform = lldb.DBG.GetSelectedPlatform().GetTriple().split('-')[2]
+                if supported_categories is None:
+                    target_platform = lldb.DBG.GetSelectedPlatform().GetTriple().split('-')[2]
+                    supported_categories = set(c for c in all_dbginfo_categories
+                                               if test_categories.is_supported_on_platform(c, target_platform))
 
                 # If any debug info categories were explicitly tagged, assume that list to be
                 # authoritative.  If none were specified, try with all debug info formats.
-                all_dbginfo_categories = set(test_categories.debug_info_categories)
                 categories = set(getattr(attrvalue, "categories", [])) & all_dbginfo_categories
                 if not categories:
                     categories = all_dbginfo_categories
+                categories = categories & supported_categories
 
-                supported_categories = [x for x in categories 
-                                        if test_categories.is_supported_on_platform(x, target_platform)]
-                if "dsym" in supported_categories:
-                    @decorators.add_test_categories(["dsym"])
-                    @wraps(attrvalue)
-                    def dsym_test_method(self, attrvalue=attrvalue):
-                        self.debug_info = "dsym"
-                        return attrvalue(self)
-                    dsym_method_name = attrname + "_dsym"
-                    dsym_test_method.__name__ = dsym_method_name
-                    newattrs[dsym_method_name] = dsym_test_method
-
-                if "dwarf" in supported_categories:
-                    @decorators.add_test_categories(["dwarf"])
-                    @wraps(attrvalue)
-                    def dwarf_test_method(self, attrvalue=attrvalue):
-                        self.debug_info = "dwarf"
-                        return attrvalue(self)
-                    dwarf_method_name = attrname + "_dwarf"
-                    dwarf_test_method.__name__ = dwarf_method_name
-                    newattrs[dwarf_method_name] = dwarf_test_method
-
-                if "dwo" in supported_categories:
-                    @decorators.add_test_categories(["dwo"])
-                    @wraps(attrvalue)
-                    def dwo_test_method(self, attrvalue=attrvalue):
-                        self.debug_info = "dwo"
-                        return attrvalue(self)
-                    dwo_method_name = attrname + "_dwo"
-                    dwo_test_method.__name__ = dwo_method_name
-                    newattrs[dwo_method_name] = dwo_test_method
+                for debug_info in ("dsym", "dwarf", "dwo"):
+                    if debug_info in categories:
+                        method_name = attrname + "_" + debug_info
+                        newattrs[method_name] = _debug_info_test_method(method_name, attrvalue, debug_info)
             else:
                 newattrs[attrname] = attrvalue
         return super(LLDBTestCaseFactory, cls).__new__(cls, name, bases, newattrs)
@@ -1555,22 +1837,30 @@ class TestBase(Base):
     # looping endlessly - subclasses are free to define their own categories
     # in whatever way makes sense to them
     def getCategories(self):
-        import inspect
-        import os.path
-        folder = inspect.getfile(self.__class__)
-        folder = os.path.dirname(folder)
-        while folder != '/':
+        folder = _test_folders.get(self.__class__)
+        if folder is None:
+                folder = inspect.getfile(self.__class__)
+                folder = _test_folders[self.__class__] = os.path.dirname(folder)
+        # Sibling test directories share their ancestors' .categories, so every
+        # folder visited on the way up remembers the result.
+        visited = []
+        while folder != '/' and folder not in _categories_cache:
+                visited.append(folder)
                 categories_file_name = os.path.join(folder,".categories")
                 if os.path.exists(categories_file_name):
-                        categories_file = open(categories_file_name,'r')
-                        categories = categories_file.readline()
-                        categories_file.close()
-                        categories = str.replace(categories,'\n','')
-                        categories = str.replace(categories,'\r','')
-                        return categories.split(',')
+                        with open(categories_file_name,'r') as categories_file:
+                                categories = categories_file.readline()
+                        categories = categories.replace('\n','').replace('\r','')
+                        _categories_cache[folder] = categories.split(',')
+                        break
                 else:
                         folder = os.path.dirname(folder)
                         continue
+        categories = _categories_cache.get(folder)
+        for visited_folder in visited:
+                _categories_cache[visited_folder] = categories
+        if categories is not None:
+                return list(categories)
 
     def setUp(self):
         #import traceback
@@ -1579,11 +1869,11 @@ class TestBase(Base):
         # Works with the test driver to conditionally skip tests via decorators.
         Base.setUp(self)
 
-        if "LLDB_MAX_LAUNCH_COUNT" in os.environ:
-            self.maxLaunchCount = int(os.environ["LLDB_MAX_LAUNCH_COUNT"])
+        if maxLaunchCountOverride is not None:
+            self.maxLaunchCount = maxLaunchCountOverride
 
-        if "LLDB_TIME_WAIT_NEXT_LAUNCH" in os.environ:
-            self.timeWaitNextLaunch = float(os.environ["LLDB_TIME_WAIT_NEXT_LAUNCH"])
+        if timeWaitNextLaunchOverride is not None:
+            self.timeWaitNextLaunch = timeWaitNextLaunchOverride
 
         # We want our debugger to be synchronous.
         self.dbg.SetAsync(False)
@@ -1606,17 +1896,11 @@ class TestBase(Base):
             if error.Success():
                 lldb.remote_platform.SetWorkingDirectory(remote_test_dir)
 
-                # This function removes all files from the current working directory while leaving
-                # the directories in place. The cleaup is required to reduce the disk space required
-                # by the test suit while leaving the directories untached is neccessary because
-                # sub-directories might belong to an other test
-                def clean_working_directory():
-                    # TODO: Make it working on Windows when we need it for remote debugging support
-                    # TODO: Replace the heuristic to remove the files with a logic what collects the
-                    # list of files we have to remove during test runs.
-                    shell_cmd = lldb.SBPlatformShellCommand("rm %s/*" % remote_test_dir)
-                    lldb.remote_platform.Run(shell_cmd)
-                self.addTearDownHook(clean_working_directory)
+                # The files are removed for all of the class's tests at once in
+                # tearDownClass().
+                if self.remoteWorkingDirs is None:
+                    self.__class__.remoteWorkingDirs = []
+                self.remoteWorkingDirs.append(remote_test_dir)
             else:
                 print("error: making remote directory '%s': %s" % (remote_test_dir, error))
     
@@ -1637,6 +1921,7 @@ class TestBase(Base):
 
         working_dir = self.get_process_working_directory()
         environment = ['%s=%s' % (shlib_environment_var, working_dir)]
+        cwd = os.getcwd()
         # Add any shared libraries to our target if remote so they get
         # uploaded into the working directory on the remote side
         for name in shlibs:
@@ -1648,14 +1933,14 @@ class TestBase(Base):
                 local_shlib_path = name # name is the full path to the local shared library
             else:
                 # Check relative names
-                local_shlib_path = os.path.join(os.getcwd(), shlib_prefix + name + shlib_extension)
-                if not os.path.exists(local_shlib_path):
-                    local_shlib_path = os.path.join(os.getcwd(), name + shlib_extension)
-                    if not os.path.exists(local_shlib_path):
-                        local_shlib_path = os.path.join(os.getcwd(), name)
-
-                # Make sure we found the local shared library in the above code
-                self.assertTrue(os.path.exists(local_shlib_path))
+                for local_shlib_path in (os.path.join(cwd, shlib_prefix + name + shlib_extension),
+                                         os.path.join(cwd, name + shlib_extension),
+                                         os.path.join(cwd, name)):
+                    if os.path.exists(local_shlib_path):
+                        break
+                else:
+                    # Make sure we found the local shared library in the above code
+                    self.fail("Unable to find the local copy of shared library %s" % name)
 
             # Add the shared library to our target
             shlib_module = target.AddModule(local_shlib_path, None, None, None)
@@ -1703,22 +1988,26 @@ class TestBase(Base):
 
         # Ensure all the references to SB objects have gone away so that we can
         # be sure that all test-specific resources have been freed before we
-        # attempt to delete the targets.
-        gc.collect()
+        # attempt to delete the targets.  With no targets to delete, the full
+        # collection can be skipped.
+        if self.dbg.GetNumTargets():
+            gc.collect()
 
         # Delete the target(s) from the debugger as a general cleanup step.
         # This includes terminating the process for each target, if any.
         # We'd like to reuse the debugger for our next test without incurring
         # the initialization overhead.
-        targets = []
-        for target in self.dbg:
-            if target:
-                targets.append(target)
-                process = target.GetProcess()
-                if process:
-                    rc = self.invoke(process, "Kill")
-                    self.assertTrue(rc.Success(), PROCESS_KILLED)
-        for target in targets:
+        # The targets are collected first, since deleting them while iterating
+        # over the debugger's target list would skip some.
+        for target in [target for target in self.dbg if target]:
+            process = target.GetProcess()
+            if process:
+                # Recorded like self.invoke(process, "Kill") would, without the
+                # reflection.
+                kill = process.Kill
+                rc = kill()
+                self._record("%s: %s" % (kill, rc), traceAlways)
+                self.assertTrue(rc.Success(), PROCESS_KILLED)
             self.dbg.DeleteTarget(target)
 
         # Do this last, to make sure it's in reverse order from how we setup.
@@ -1733,15 +2022,14 @@ class TestBase(Base):
         Run the 'thread list' command, and select the thread with stop reason as
         'stop_reason'.  If no such thread exists, no select action is done.
         """
-        from .lldbutil import stop_reason_to_str
         self.runCmd('thread list')
         output = self.res.GetOutput()
-        thread_line_pattern = re.compile("^[ *] thread #([0-9]+):.*stop reason = %s" %
-                                         stop_reason_to_str(stop_reason))
-        for line in output.splitlines():
-            matched = thread_line_pattern.match(line)
-            if matched:
-                self.runCmd('thread select %s' % matched.group(1))
+        # Multi-line mode, so that the whole output is scanned at once instead of
+        # line by line.
+        thread_line_pattern = _compile_pattern("(?m)^[ *] thread #([0-9]+):.*stop reason = %s" %
+                                               lldbutil.stop_reason_to_str(stop_reason))
+        for matched in thread_line_pattern.finditer(output):
+            self.runCmd('thread select %s' % matched.group(1))
 
     def runCmd(self, cmd, msg=None, check=True, trace=False, inHistory=False):
         """
@@ -1752,12 +2040,12 @@ class TestBase(Base):
         if not cmd or len(cmd) == 0:
             raise Exception("Bad 'cmd' parameter encountered")
 
-        trace = (True if traceAlways else trace)
+        trace = trace or traceAlways
 
         if cmd.startswith("target create "):
-            cmd = cmd.replace("target create ", "file ")
+            cmd = "file " + cmd[len("target create "):]
 
-        running = (cmd.startswith("run") or cmd.startswith("process launch"))
+        running = cmd.startswith(("run", "process launch"))
 
         for i in range(self.maxLaunchCount if running else 1):
             self.ci.HandleCommand(cmd, self.res, inHistory)
@@ -1781,20 +2069,22 @@ class TestBase(Base):
                     print("Command '" + cmd + "' failed!", file=sbuf)
 
         if check:
-            self.assertTrue(self.res.Succeeded(),
-                            msg if msg else CMD_MSG(cmd))
+            succeeded = self.res.Succeeded()
+            if not succeeded:
+                # Only format the assert message when the check actually fails.
+                self.assertTrue(succeeded, msg if msg else CMD_MSG(cmd))
 
     def match (self, str, patterns, msg=None, trace=False, error=False, matching=True, exe=True):
         """run command in str, and match the result against regexp in patterns returning the match object for the first matching pattern
 
         Otherwise, all the arguments have the same meanings as for the expect function"""
 
-        trace = (True if traceAlways else trace)
+        trace = trace or traceAlways
 
         if exe:
             # First run the command.  If we are expecting error, set check=False.
             # Pass the assert message along since it provides more semantic info.
-            self.runCmd(str, msg=msg, trace = (True if trace else False), check = not error)
+            self.runCmd(str, msg=msg, trace = trace, check = not error)
 
             # Then compare the output against expected strings.
             output = self.res.GetError() if error else self.res.GetOutput()
@@ -1806,24 +2096,23 @@ class TestBase(Base):
         else:
             # No execution required, just compare str against the golden input.
             output = str
-            with recording(self, trace) as sbuf:
-                print("looking at:", output, file=sbuf)
+            self._record("looking at: %s" % output, trace)
 
         # The heading says either "Expecting" or "Not expecting".
         heading = "Expecting" if matching else "Not expecting"
 
         for pattern in patterns:
             # Match Objects always have a boolean value of True.
-            match_object = re.search(pattern, output)
+            match_object = _compile_pattern(pattern).search(output)
             matched = bool(match_object)
-            with recording(self, trace) as sbuf:
-                print("%s pattern: %s" % (heading, pattern), file=sbuf)
-                print("Matched" if matched else "Not matched", file=sbuf)
+            self._record("%s pattern: %s\n%s" % (heading, pattern, "Matched" if matched else "Not matched"), trace)
             if matched:
                 break
 
-        self.assertTrue(matched if matching else not matched,
-                        msg if msg else EXP_MSG(str, output, exe))
+        as_expected = matched if matching else not matched
+        if not as_expected:
+            # Only format the assert message when the check actually fails.
+            self.assertTrue(as_expected, msg if msg else EXP_MSG(str, output, exe))
 
         return match_object        
 
@@ -1851,12 +2140,12 @@ class TestBase(Base):
         set to False, the 'str' is treated as a string to be matched/not-matched
         against the golden input.
         """
-        trace = (True if traceAlways else trace)
+        trace = trace or traceAlways
 
         if exe:
             # First run the command.  If we are expecting error, set check=False.
             # Pass the assert message along since it provides more semantic info.
-            self.runCmd(str, msg=msg, trace = (True if trace else False), check = not error, inHistory=inHistory)
+            self.runCmd(str, msg=msg, trace = trace, check = not error, inHistory=inHistory)
 
             # Then compare the output against expected strings.
             output = self.res.GetError() if error else self.res.GetOutput()
@@ -1871,8 +2160,7 @@ class TestBase(Base):
                 output = str.GetOutput()
             else:
                 output = str
-            with recording(self, trace) as sbuf:
-                print("looking at:", output, file=sbuf)
+            self._record("looking at: %s" % output, trace)
 
         # The heading says either "Expecting" or "Not expecting".
         heading = "Expecting" if matching else "Not expecting"
@@ -1882,52 +2170,65 @@ class TestBase(Base):
         matched = output.startswith(startstr) if startstr else (True if matching else False)
 
         if startstr:
-            with recording(self, trace) as sbuf:
-                print("%s start string: %s" % (heading, startstr), file=sbuf)
-                print("Matched" if matched else "Not matched", file=sbuf)
+            self._record("%s start string: %s\n%s" % (heading, startstr, "Matched" if matched else "Not matched"), trace)
 
         # Look for endstr, if specified.
         keepgoing = matched if matching else not matched
         if endstr:
             matched = output.endswith(endstr)
-            with recording(self, trace) as sbuf:
-                print("%s end string: %s" % (heading, endstr), file=sbuf)
-                print("Matched" if matched else "Not matched", file=sbuf)
+            self._record("%s end string: %s\n%s" % (heading, endstr, "Matched" if matched else "Not matched"), trace)
 
         # Look for sub strings, if specified.
         keepgoing = matched if matching else not matched
         if substrs and keepgoing:
-            for substr in substrs:
-                matched = output.find(substr) != -1
-                with recording(self, trace) as sbuf:
-                    print("%s sub string: %s" % (heading, substr), file=sbuf)
-                    print("Matched" if matched else "Not matched", file=sbuf)
-                keepgoing = matched if matching else not matched
-                if not keepgoing:
-                    break
+            if matching:
+                as_expected = all(substr in output for substr in substrs)
+            else:
+                as_expected = not any(substr in output for substr in substrs)
+            if as_expected:
+                # The usual case: all of them came out as expected, so there is
+                # no need to stop at each one, and they are recorded in one go.
+                matched = True if matching else False
+                self._record("\n\n".join("%s sub string: %s\n%s" % (heading, substr, "Matched" if matched else "Not matched")
+                                          for substr in substrs), trace)
+            else:
+                for substr in substrs:
+                    matched = substr in output
+                    self._record("%s sub string: %s\n%s" % (heading, substr, "Matched" if matched else "Not matched"), trace)
+                    keepgoing = matched if matching else not matched
+                    if not keepgoing:
+                        break
 
         # Search for regular expression patterns, if specified.
         keepgoing = matched if matching else not matched
         if patterns and keepgoing:
-            for pattern in patterns:
-                # Match Objects always have a boolean value of True.
-                matched = bool(re.search(pattern, output))
-                with recording(self, trace) as sbuf:
-                    print("%s pattern: %s" % (heading, pattern), file=sbuf)
-                    print("Matched" if matched else "Not matched", file=sbuf)
-                keepgoing = matched if matching else not matched
-                if not keepgoing:
-                    break
-
-        self.assertTrue(matched if matching else not matched,
-                        msg if msg else EXP_MSG(str, output, exe))
+            # Match Objects always have a boolean value of True.
+            if matching:
+                as_expected = all(_compile_pattern(pattern).search(output) for pattern in patterns)
+            else:
+                as_expected = not any(_compile_pattern(pattern).search(output) for pattern in patterns)
+            if as_expected:
+                matched = True if matching else False
+                self._record("\n\n".join("%s pattern: %s\n%s" % (heading, pattern, "Matched" if matched else "Not matched")
+                                          for pattern in patterns), trace)
+            else:
+                for pattern in patterns:
+                    matched = bool(_compile_pattern(pattern).search(output))
+                    self._record("%s pattern: %s\n%s" % (heading, pattern, "Matched" if matched else "Not matched"), trace)
+                    keepgoing = matched if matching else not matched
+                    if not keepgoing:
+                        break
+
+        as_expected = matched if matching else not matched
+        if not as_expected:
+            # Only format the assert message when the check actually fails.
+            self.assertTrue(as_expected, msg if msg else EXP_MSG(str, output, exe))
 
     def invoke(self, obj, name, trace=False):
         """Use reflection to call a method dynamically with no argument."""
-        trace = (True if traceAlways else trace)
+        trace = trace or traceAlways
         
         method = getattr(obj, name)
-        import inspect
         self.assertTrue(inspect.ismethod(method),
                         name + "is a method name of object: " + str(obj))
         result = method()
@@ -1937,18 +2238,12 @@ class TestBase(Base):
 
     def build(self, architecture=None, compiler=None, dictionary=None, clean=True):
         """Platform specific way to build the default binaries."""
-        module = builder_module()
         dictionary = lldbplatformutil.finalize_build_dictionary(dictionary)
-        if self.debug_info is None:
-            return self.buildDefault(architecture, compiler, dictionary, clean)
-        elif self.debug_info == "dsym":
-            return self.buildDsym(architecture, compiler, dictionary, clean)
-        elif self.debug_info == "dwarf":
-            return self.buildDwarf(architecture, compiler, dictionary, clean)
-        elif self.debug_info == "dwo":
-            return self.buildDwo(architecture, compiler, dictionary, clean)
-        else:
+        build_method = _build_methods.get(self.debug_info)
+        if build_method is None:
             self.fail("Can't build for debug info: %s" % self.debug_info)
+        # Looked up by name, so that subclasses can still override them.
+        return getattr(self, build_method)(architecture, compiler, dictionary, clean)
 
     def run_platform_command(self, cmd):
         platform = self.dbg.GetSelectedPlatform()
@@ -1962,11 +2257,6 @@ class TestBase(Base):
 
     def DebugSBValue(self, val):
         """Debug print a SBValue object, if traceAlways is True."""
-        from .lldbutil import value_type_to_str
-
-        if not traceAlways:
-            return
-
         err = sys.stderr
         err.write(val.GetName() + ":\n")
         err.write('\t' + "TypeName         -> " + val.GetTypeName()            + '\n')
@@ -1974,16 +2264,13 @@ class TestBase(Base):
         err.write('\t' + "NumChildren      -> " + str(val.GetNumChildren())    + '\n')
         err.write('\t' + "Value            -> " + str(val.GetValue())          + '\n')
         err.write('\t' + "ValueAsUnsigned  -> " + str(val.GetValueAsUnsigned())+ '\n')
-        err.write('\t' + "ValueType        -> " + value_type_to_str(val.GetValueType()) + '\n')
+        err.write('\t' + "ValueType        -> " + lldbutil.value_type_to_str(val.GetValueType()) + '\n')
         err.write('\t' + "Summary          -> " + str(val.GetSummary())        + '\n')
         err.write('\t' + "IsPointerType    -> " + str(val.TypeIsPointerType()) + '\n')
         err.write('\t' + "Location         -> " + val.GetLocation()            + '\n')
 
     def DebugSBType(self, type):
         """Debug print a SBType object, if traceAlways is True."""
-        if not traceAlways:
-            return
-
         err = sys.stderr
         err.write(type.GetName() + ":\n")
         err.write('\t' + "ByteSize        -> " + str(type.GetByteSize())     + '\n')
@@ -1992,25 +2279,57 @@ class TestBase(Base):
 
     def DebugPExpect(self, child):
         """Debug the spwaned pexpect object."""
-        if not traceAlways:
-            return
-
         print(child)
 
+    if not traceAlways:
+        # traceAlways is set once this module is imported, so without it the
+        # debug print methods above are replaced with no-ops up front.
+        def _debugPrintNothing(self, obj):
+            pass
+        DebugSBValue = DebugSBType = DebugPExpect = _debugPrintNothing
+        del _debugPrintNothing
+
     @classmethod
     def RemoveTempFile(cls, file):
         if os.path.exists(file):
             remove_file(file)
 
+def find_log_files(log_basename):
+    """Returns the paths of the files whose path starts with log_basename."""
+    if not hasattr(os, "scandir"):
+        return [f for f in glob.glob(log_basename + "*") if os.path.isfile(f)]
+    # A single directory listing; the entries already know their file type, so
+    # no extra stat is needed per file.
+    dirname, prefix = os.path.split(log_basename)
+    return [entry.path for entry in os.scandir(dirname)
+            if entry.name.startswith(prefix) and entry.is_file()]
+
+def replace_file(src, dst):
+    """Renames src to dst, replacing dst if it already exists."""
+    if hasattr(os, "replace"):
+        # Replaces dst atomically on Windows as well, without probing for it.
+        os.replace(src, dst)
+        return
+    if os.name == "nt" and os.path.isfile(dst):
+        # On Windows, renaming a -> b will throw an exception if b exists.  On non-Windows platforms
+        # it silently replaces the destination.  Ultimately this means that atomic renames are not
+        # guaranteed to be possible on Windows, but we need this to work anyway, so just remove the
+        # destination first if it already exists.
+        remove_file(dst)
+    os.rename(src, dst)
+
 # On Windows, the first attempt to delete a recently-touched file can fail
 # because of a race with antimalware scanners.  This function will detect a
-# failure and retry.
-def remove_file(file, num_retries = 1, sleep_duration = 0.5):
+# failure and retry, waiting twice as long before each further attempt.
+def remove_file(file, num_retries = 6, sleep_duration = 0.01):
     for i in range(num_retries+1):
         try:
             os.remove(file)
             return True
-        except:
+        except OSError as exception:
+            if exception.errno == errno.ENOENT or i == num_retries:
+                # Nothing to remove, or out of attempts.
+                return False
             time.sleep(sleep_duration)
-            continue
+            sleep_duration *= 2
     return False